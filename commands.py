@@ -25,7 +25,31 @@ import socket
 import server, errors
 
 
-from typing import Optional, Dict, List
+from typing import Callable, Optional, Dict, List
+
+# Channel names must start with "#", be at most 50 characters long, and must not
+# contain spaces, bell characters (\x07), or commas.
+# TODO: Make more restrictive (currently valid: ###, #ö?!~ etc)
+FORBIDDEN_CHANNEL_CHARS = frozenset(" \x07,")
+
+# A MODE command's second parameter must start with one of these (ex. "+o", "-b").
+MODE_SIGNS = frozenset("+-")
+
+# Nicks may not start with a digit, and may only contain letters, digits and []{}|\^`_-
+NICK_REGEX = re.compile(r"[a-zA-Z|\\_\[\]{}^`-][a-zA-Z0-9|\\_\[\]{}^`-]{,15}")
+
+# An IRC message may not be longer than 512 bytes, including the source prefix
+# and the trailing "\r\n". https://modern.ircdocs.horse/#message-format
+MAX_MESSAGE_LENGTH = 512
+
+
+def is_valid_channel_name(channel_name: str) -> bool:
+    """Checks that a channel name provided in a JOIN command is valid."""
+    return (
+        2 <= len(channel_name) <= 50
+        and channel_name[0] == "#"
+        and FORBIDDEN_CHANNEL_CHARS.isdisjoint(channel_name)
+    )
 
 
 ### Handlers
@@ -100,50 +124,55 @@ def handle_join(state: server.State, user: server.UserConnection, args: List[str
         errors.not_enough_params(user, "JOIN")
         return
 
-    channel_regex = r"#[^ \x07,]{1,49}"  # TODO: Make more restrictive (currently valid: ###, #ö?!~ etc)
     channel_name = args[0]
     lower_channel_name = channel_name.lower()
 
-    if not re.match(channel_regex, lower_channel_name):
+    if not is_valid_channel_name(lower_channel_name):
         errors.no_such_channel(user, channel_name)
     else:
-        if lower_channel_name not in state.channels.keys():
-            state.channels[lower_channel_name] = server.Channel(channel_name, user)
-
-        channel = state.find_channel(channel_name)
-
-        assert channel
-
-        is_banned = channel.check_if_banned(user.get_user_mask())
+        channel = state.channels.get(lower_channel_name)
+        if channel is None:
+            channel = server.Channel(channel_name, user)
+            state.channels[lower_channel_name] = channel
+
+        # Joining a channel the user is already on is a no-op; checking this first
+        # makes redundant JOINs (ex. client resyncs) return before the ban-list scan
+        # and the names-list construction.
+        if channel.has_user(user):
+            return
 
-        if is_banned:
+        if channel.check_if_banned(user.user_mask):
             errors.banned_from_chan(user, channel)
             return
 
-        if user not in channel.users:
-            channel_users_str = ""
-            for usr in channel.users:
-                channel_users_str += f" {usr.get_prefix(channel)}{usr.nick}"
+        # The joining user goes first in the names list; they are not yet in channel.users here.
+        nick = user.nick
+        name_parts = [f"{'@' if user in channel.operators else ''}{nick}"]
+        name_parts.extend(channel.prefixed_nicks.values())
 
-            channel.users.add(user)
+        channel.add_user(user)
+        user.channels.add(channel)
+        channel.prefixed_nicks[user] = name_parts[0]
 
-            join_msg = f"JOIN {channel_name}"
-            channel.queue_message_to_chan_users(join_msg, user)
+        join_msg = f"JOIN {channel_name}"
+        channel.queue_message_to_chan_users(join_msg, user)
 
-            if channel.topic:
-                channel.send_topic_to_user(user)
+        if channel.topic:
+            channel.send_topic_to_user(user)
 
-            message = f"353 {user.nick} = {channel_name} :{user.get_prefix(channel)}{user.nick}{channel_users_str}"
-            user.send_que.put((message, "mantatail"))
+        names_prefix = f"353 {nick} = {channel_name} :"
+        messages = [
+            (names_message, "mantatail") for names_message in split_names_reply(names_prefix, name_parts)
+        ]
+        messages.append((f"366 {nick} {channel_name} :End of /NAMES list.", "mantatail"))
 
-            message = f"366 {user.nick} {channel_name} :End of /NAMES list."
-            user.send_que.put((message, "mantatail"))
+        user.send_que.put_many(messages)
 
-            if user.away:
-                away_notify_msg = f"AWAY :{user.away}"
-                for usr in channel.users:
-                    if "away-notify" in usr.cap_list:
-                        usr.send_que.put((away_notify_msg, user.get_user_mask()))
+        if user.away:
+            item = (f"AWAY :{user.away}", user.user_mask)
+            for usr in channel.users:
+                if "away-notify" in usr.cap_list:
+                    usr.send_que.put(item)
 
         # TODO: Forward to another channel (irc num 470) ex. #homebrew -> ##homebrew
 
@@ -169,7 +198,7 @@ def handle_part(state: server.State, user: server.UserConnection, args: List[str
         errors.no_such_channel(user, channel_name)
         return
 
-    if user not in channel.users:
+    if not channel.has_user(user):
         errors.not_on_channel(user, channel_name)
     else:
         channel.operators.discard(user)
@@ -177,9 +206,11 @@ def handle_part(state: server.State, user: server.UserConnection, args: List[str
         part_message = f"PART {channel_name}"
         channel.queue_message_to_chan_users(part_message, user)
 
-        channel.users.discard(user)
-        if len(channel.users) == 0:
-            state.delete_channel(channel_name)
+        channel.remove_user(user)
+        user.channels.discard(channel)
+        channel.prefixed_nicks.pop(user, None)
+        if not channel.users:
+            state.delete_channel(channel)
 
 
 def handle_mode(state: server.State, user: server.UserConnection, args: List[str]) -> None:
@@ -205,7 +236,7 @@ def handle_mode(state: server.State, user: server.UserConnection, args: List[str
             errors.no_such_channel(user, args[0])
             return
         else:
-            if user != target_usr:
+            if user is not target_usr:
                 # TODO: The actual IRC error for this should be "502 Can't change mode for other users"
                 # This will be implemented when MODE becomes more widely supported.
                 # Currently not sure which modes 502 applies to.
@@ -219,43 +250,48 @@ def handle_nick(state: server.State, user: server.UserConnection, args: List[str
     Sets a user's nickname if they don't already have one.
     Changes the user's nickname if they already have one.
     """
-    nick_regex = r"[a-zA-Z|\\_\[\]{}^`-][a-zA-Z0-9|\\_\[\]{}^`-]{,15}"
-
     if not args:
         errors.no_nickname_given(user)
         return
 
     new_nick = args[0]
-    if not re.fullmatch(nick_regex, new_nick):
+    if not NICK_REGEX.fullmatch(new_nick):
         errors.erroneus_nickname(user, new_nick)
         return
 
     existing_user = state.find_user(new_nick)
-    if existing_user is not None and existing_user != user:
+    if existing_user is not None and existing_user is not user:
         errors.nick_in_use(user, new_nick)
     else:
         if user.nick == "*":
             user.nick = new_nick
-            state.connected_users[user.nick.lower()] = user
+            user.lower_nick = new_nick.lower()
+            user.update_user_mask()
+            state.connected_users[user.lower_nick] = user
         else:
             if new_nick == user.nick:
                 return
             # Avoids sending NICK message to users several times if user shares more than one channel with them.
             receivers = user.get_users_sharing_channel()
-            message = f"NICK :{new_nick}"
+            item = (f"NICK :{new_nick}", user.user_mask)
 
             for receiver in receivers:
-                receiver.send_que.put((message, user.get_user_mask()))
+                receiver.send_que.put(item)
 
             # User doesn't get NICK message if they change their nicks before sending USER command
             if user.user_message:
-                user.send_que.put((message, user.get_user_mask()))
+                user.send_que.put(item)
 
             # Not using state.delete_user() as that will delete the user from all channels as well.
-            del state.connected_users[user.nick.lower()]
+            state.connected_users.pop(user.lower_nick, None)
 
             user.nick = new_nick
-            state.connected_users[user.nick.lower()] = user
+            user.lower_nick = new_nick.lower()
+            user.update_user_mask()
+            state.connected_users[user.lower_nick] = user
+
+            for channel in user.channels:
+                channel.prefixed_nicks[user] = f"{'@' if user in channel.operators else ''}{new_nick}"
 
 
 def handle_away(state: server.State, user: server.UserConnection, args: List[str]) -> None:
@@ -284,11 +320,11 @@ def handle_away(state: server.State, user: server.UserConnection, args: List[str
         user.away = args[0]
 
     user.send_que.put((msg_to_self, "mantatail"))
-    away_notify_msg = f"AWAY :{away_parameter}"
+    item = (f"AWAY :{away_parameter}", user.user_mask)
 
     for receiver in receivers:
         if "away-notify" in receiver.cap_list:
-            receiver.send_que.put((away_notify_msg, user.get_user_mask()))
+            receiver.send_que.put(item)
 
 
 def handle_topic(state: server.State, user: server.UserConnection, args: List[str]) -> None:
@@ -319,10 +355,8 @@ def handle_topic(state: server.State, user: server.UserConnection, args: List[st
         else:
             channel.set_topic(user, args[1])
 
-            if not args[1]:
-                topic_message = f"TOPIC {channel.name} :"
-            else:
-                topic_message = f"TOPIC {channel.name} :{args[1]}"
+            # Also correct for an empty args[1] (cleared topic): "TOPIC #foo :"
+            topic_message = f"TOPIC {channel.name} :{args[1]}"
 
             channel.queue_message_to_chan_users(topic_message, user)
 
@@ -346,16 +380,18 @@ def handle_kick(state: server.State, user: server.UserConnection, args: List[str
         errors.no_such_channel(user, args[0])
         return
 
+    # Checking operator status before looking up the target lets the common
+    # error case (a non-operator trying to kick) return without extra lookups.
+    if user not in channel.operators:
+        errors.no_operator_privileges(user, channel)
+        return
+
     target_usr = state.find_user(args[1])
     if not target_usr:
         errors.no_such_nick_channel(user, args[1])
         return
 
-    if user not in channel.operators:
-        errors.no_operator_privileges(user, channel)
-        return
-
-    if target_usr not in channel.users:
+    if not channel.has_user(target_usr):
         errors.user_not_in_channel(user, target_usr, channel)
         return
 
@@ -366,11 +402,13 @@ def handle_kick(state: server.State, user: server.UserConnection, args: List[str
         kick_message = f"KICK {channel.name} {target_usr.nick} :{reason}"
 
     channel.queue_message_to_chan_users(kick_message, user)
-    channel.users.discard(target_usr)
+    channel.remove_user(target_usr)
+    target_usr.channels.discard(channel)
     channel.operators.discard(target_usr)
+    channel.prefixed_nicks.pop(target_usr, None)
 
-    if len(channel.users) == 0:
-        state.delete_channel(channel.name)
+    if not channel.users:
+        state.delete_channel(channel)
 
 
 def handle_quit(state: server.State, user: server.UserConnection, args: List[str]) -> None:
@@ -402,7 +440,7 @@ def handle_privmsg(state: server.State, user: server.UserConnection, args: List[
 
     (receiver, privmsg) = args[0], args[1]
 
-    if receiver.startswith("#"):
+    if receiver[:1] == "#":
 
         channel = state.find_channel(receiver)
         if not channel:
@@ -415,9 +453,9 @@ def handle_privmsg(state: server.State, user: server.UserConnection, args: List[
     # USER MASK:  Bob!BobUsr@127.0.0.1
     # BAN LIST:  ['Bob!*@*']
 
-    is_banned = channel.check_if_banned(user.get_user_mask())
+    is_banned = channel.check_if_banned(user.user_mask)
 
-    if user not in channel.users:
+    if not channel.has_user(user):
         errors.not_on_channel(user, receiver)
     elif is_banned:
         errors.cannot_send_to_channel(user, channel.name)
@@ -436,18 +474,22 @@ def handle_who(state: server.State, user: server.UserConnection, args: List[str]
         channel = state.find_channel(args[0])
 
         if channel:
+            nick = user.nick
+            operators = channel.operators
             for who_usr in channel.users:
                 if not who_usr.away:
                     away_status = "H"
                 else:
                     away_status = "G"
 
+                prefix = "@" if who_usr in operators else ""
+
                 # ":0" refers to "hopcount", which is not supported by Mantatail.
                 # "Hopcount is the number of intermediate servers between the client issuing the WHO command
                 # and the client Nickname, it might be unreliable so clients SHOULD ignore it.""
-                who_message = f"352 {user.nick} {channel.name} {who_usr.user_name} {who_usr.host} Mantatail {who_usr.nick} {away_status}{who_usr.get_prefix(channel)} :0 {who_usr.real_name}"
+                who_message = f"352 {nick} {channel.name} {who_usr.user_name} {who_usr.host} Mantatail {who_usr.nick} {away_status}{prefix} :0 {who_usr.real_name}"
 
-                if user not in channel.users:
+                if not channel.has_user(user):
                     if "i" not in who_usr.modes:
                         user.send_que.put((who_message, "mantatail"))
                 else:
@@ -528,6 +570,33 @@ def handle_pong(state: server.State, user: server.UserConnection, args: List[str
 
 
 # Private functions
+def split_names_reply(names_prefix: str, name_parts: List[str]) -> List[str]:
+    """
+    Builds the 353 (RPL_NAMREPLY) messages for a channel's names list.
+
+    On big channels, one message would exceed the 512-byte line limit and get
+    truncated by clients, so the names are split over as many messages as needed.
+    """
+    # All communication is encoded with latin-1, so one character == one byte.
+    budget = MAX_MESSAGE_LENGTH - len(":mantatail ") - len(names_prefix) - len("\r\n")
+
+    messages = []
+    current_parts: List[str] = []
+    current_length = 0
+    for part in name_parts:
+        added_length = len(part) + 1 if current_parts else len(part)  # +1 for the separating space
+        if current_parts and current_length + added_length > budget:
+            messages.append(names_prefix + " ".join(current_parts))
+            current_parts = [part]
+            current_length = len(part)
+        else:
+            current_parts.append(part)
+            current_length += added_length
+
+    messages.append(names_prefix + " ".join(current_parts))
+    return messages
+
+
 def privmsg_to_user(state: server.State, sender: server.UserConnection, receiver: str, privmsg: str) -> None:
     receiver_usr = state.find_user(receiver)
     if not receiver_usr:
@@ -535,7 +604,7 @@ def privmsg_to_user(state: server.State, sender: server.UserConnection, receiver
         return
 
     message = f"PRIVMSG {receiver_usr.nick} :{privmsg}"
-    receiver_usr.send_que.put((message, sender.get_user_mask()))
+    receiver_usr.send_que.put((message, sender.user_mask))
 
     if receiver_usr.away:
         away_message = f"301 {sender.nick} {receiver_usr.nick} :{receiver_usr.away}"
@@ -543,18 +612,18 @@ def privmsg_to_user(state: server.State, sender: server.UserConnection, receiver
 
 
 def whois_reply(user: server.UserConnection, whois_user: server.UserConnection) -> None:
+    nick = user.nick
     whoisuser_message = (
-        f"311 {user.nick} {whois_user.nick} {whois_user.user_name} {whois_user.host} * :{whois_user.real_name}"
+        f"311 {nick} {whois_user.nick} {whois_user.user_name} {whois_user.host} * :{whois_user.real_name}"
     )
 
-    endofwhois_message = f"318 {user.nick} {whois_user.nick} :End of /WHOIS list."
+    endofwhois_message = f"318 {nick} {whois_user.nick} :End of /WHOIS list."
 
-    user.send_que.put((whoisuser_message, "mantatail"))
-    user.send_que.put((endofwhois_message, "mantatail"))
+    user.send_que.put_many([(whoisuser_message, "mantatail"), (endofwhois_message, "mantatail")])
 
 
 def rpl_welcome(user: server.UserConnection) -> None:
-    welcome_msg = f"001 {user.nick} :Welcome to Mantatail {user.get_user_mask()}"
+    welcome_msg = f"001 {user.nick} :Welcome to Mantatail {user.user_mask}"
     user.send_que.put((welcome_msg, "mantatail"))
 
 
@@ -569,9 +638,8 @@ def rpl_created(user: server.UserConnection) -> None:
 
 
 def rpl_myinfo(user: server.UserConnection, state: server.State) -> None:
-    all_supported_modes_joined = "".join(
-        [mode for key in state.supported_modes.keys() for mode in state.supported_modes[key]]
-    )
+    supported_modes = state.supported_modes
+    all_supported_modes_joined = "".join([mode for modes in supported_modes.values() for mode in modes])
     myinfo_msg = f"004 {user.nick} Mantatail {server.MANTATAIL_VERSION} {all_supported_modes_joined}"
     user.send_que.put((myinfo_msg, "mantatail"))
 
@@ -592,23 +660,25 @@ def motd(motd_content: Optional[Dict[str, List[str]]], user: server.UserConnecti
 
     This is sent to a user when they have registered a nick and a username on the server.
     """
-    motd_start_and_end = {
-        "start_msg": f"375 {user.nick} :- mantatail Message of the day - ",
-        "end_msg": f"376 {user.nick} :End of /MOTD command",
-    }
-
-    user.send_que.put((motd_start_and_end["start_msg"], "mantatail"))
+    nick = user.nick
+    start_msg = f"375 {nick} :- mantatail Message of the day - "
+    end_msg = f"376 {nick} :End of /MOTD command"
 
     if motd_content:
-        motd = motd_content["motd"]
-        for motd_line in motd:
-            motd_message = f"372 {user.nick} :{motd_line.format(user_nick=user.nick)}"
-            user.send_que.put((motd_message, "mantatail"))
+        messages = [(start_msg, "mantatail")]
+        for motd_line in motd_content["motd"]:
+            # str.format() re-parses the line on every call, and most motd lines
+            # don't contain a {user_nick} placeholder at all.
+            if "{" in motd_line:
+                motd_line = motd_line.format(user_nick=nick)
+            messages.append((f"372 {nick} :{motd_line}", "mantatail"))
+        messages.append((end_msg, "mantatail"))
+        user.send_que.put_many(messages)
     # If motd.json could not be found
     else:
+        user.send_que.put((start_msg, "mantatail"))
         errors.no_motd(user)
-
-    user.send_que.put((motd_start_and_end["end_msg"], "mantatail"))
+        user.send_que.put((end_msg, "mantatail"))
 
 
 def process_channel_modes(state: server.State, user: server.UserConnection, args: List[str]) -> None:
@@ -631,14 +701,12 @@ def process_channel_modes(state: server.State, user: server.UserConnection, args
             message = f"324 {user.nick} {channel.name}"
         user.send_que.put((message, "mantatail"))
     else:
-        if args[1][0] not in ["+", "-"]:
+        if args[1][0] not in MODE_SIGNS:
             errors.unknown_mode(user, args[1][0])
             return
 
-        supported_modes = [mode for modes in state.supported_modes.values() for mode in modes]
-
         for mode in args[1][1:]:
-            if mode not in supported_modes or not re.fullmatch(r"[a-zA-Z]", mode):
+            if mode not in state.supported_mode_letters:
                 errors.unknown_mode(user, mode)
                 return
 
@@ -685,7 +753,7 @@ def process_mode_b(
     # Not sending message if "+b" and target usr is already banned (or vice versa)
     if mode_command == "+" and not is_already_banned:
         channel.queue_message_to_chan_users(mode_message, user)
-        channel.ban_list[target_ban_mask] = user.get_user_mask()
+        channel.ban_list[target_ban_mask] = user.user_mask
 
     elif mode_command == "-" and is_already_banned:
         channel.queue_message_to_chan_users(mode_message, user)
@@ -715,7 +783,7 @@ def process_mode_o(
     if user not in channel.operators:
         errors.no_operator_privileges(user, channel)
         return
-    if target_usr not in channel.users:
+    if not channel.has_user(target_usr):
         errors.user_not_in_channel(user, target_usr, channel)
         return
 
@@ -724,10 +792,12 @@ def process_mode_o(
     if mode_command == "+" and target_usr not in channel.operators:
         channel.queue_message_to_chan_users(mode_message, user)
         channel.operators.add(target_usr)
+        channel.prefixed_nicks[target_usr] = f"@{target_usr.nick}"
 
     elif mode_command == "-" and target_usr in channel.operators:
         channel.queue_message_to_chan_users(mode_message, user)
         channel.operators.discard(target_usr)
+        channel.prefixed_nicks[target_usr] = target_usr.nick
 
 
 def process_mode_t(user: server.UserConnection, channel: server.Channel, mode_command: str) -> None:
@@ -769,15 +839,18 @@ def generate_ban_mask(ban_target: str) -> str:
     '*!*@Baz'
     """
     if "!" in ban_target and "@" in ban_target:
-        ban_mask_regex = r"([^!]*)!(.*)@(.*)"
-        ban_match = re.fullmatch(ban_mask_regex, ban_target)
-        if not ban_match:
+        first_bang = ban_target.find("!")
+        last_at = ban_target.rfind("@")
+        if last_at > first_bang:
+            nick = ban_target[:first_bang]
+            user = ban_target[first_bang + 1 : last_at]
+            host = ban_target[last_at + 1 :]
+        else:
             # @ before ! (corner case)
-            ban_mask_regex = r"(.*)@(.*)!(.*)"
-            ban_match = re.fullmatch(ban_mask_regex, ban_target)
-
-        assert ban_match is not None  # Keeps mypy silent
-        nick, user, host = ban_match.groups()
+            last_bang = ban_target.rfind("!")
+            nick = ban_target[:last_at]
+            user = ban_target[last_at + 1 : last_bang]
+            host = ban_target[last_bang + 1 :]
 
     elif "!" in ban_target:
         nick, user = ban_target.split("!", 1)
@@ -800,3 +873,12 @@ def generate_ban_mask(ban_target: str) -> str:
         host = "*"
 
     return f"{nick}!{user}@{host}"
+
+
+# Maps a lowercase command (ex. "join") to its handler function, so that the
+# receive loop can dispatch with one dict lookup instead of building a
+# "handle_..." attribute name and calling getattr() per message.
+# Built once when the module is imported.
+HANDLERS: Dict[str, Callable[[server.State, server.UserConnection, List[str]], None]] = {
+    name[len("handle_") :]: handler for name, handler in globals().items() if name.startswith("handle_")
+}
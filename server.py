@@ -6,16 +6,28 @@ This ensures compatibility regardless of what encoding is used client-side.
 """
 
 from __future__ import annotations
+import logging
 import socket
 import threading
 import queue
 import fnmatch
 import json
 from datetime import datetime
-from typing import Dict, Optional, List, Set, Tuple
+from typing import Dict, Optional, List, Set, Tuple, Union, TYPE_CHECKING
 
 import commands, errors
 
+if TYPE_CHECKING:
+    # An item in a user's send queue: (message, prefix), where a bytes message is a
+    # pre-encoded line and a None message means "disconnect". See UserConnection docs.
+    QueueItem = Tuple[Union[str, bytes, None], Optional[str]]
+    # queue.Queue only supports [] at runtime on Python 3.9+.
+    _SendQueueBase = queue.Queue[QueueItem]
+else:
+    _SendQueueBase = queue.Queue
+
+LOGGER = logging.getLogger(__name__)
+
 MANTATAIL_VERSION = "0.0.1"
 SERVER_STARTED = datetime.today().ctime()
 PING_TIMER_SECS = 180
@@ -58,6 +70,9 @@ class State:
         # o: Set/Unset channel operator (channel)
         # t: Only operator can set channel topic (channel)
         self.supported_modes: Dict[str, List[str]] = {"A": ["b"], "B": [], "C": [], "D": ["i", "t"], "PREFIX": ["o"]}
+        # Flattened from supported_modes once, so that MODE commands can check
+        # "is this mode supported?" with a single set lookup.
+        self.supported_mode_letters = frozenset(mode for modes in self.supported_modes.values() for mode in modes)
 
     def find_user(self, nick: str) -> Optional[UserConnection]:
         """
@@ -90,16 +105,19 @@ class State:
         user = self.find_user(nick)
         assert user is not None
 
-        for channel in self.channels.values():
-            if user in channel.users:
-                channel.users.discard(user)
-        del self.connected_users[nick.lower()]
+        for channel in user.channels:
+            channel.remove_user(user)
+            channel.prefixed_nicks.pop(user, None)
+            if not channel.users:
+                self.delete_channel(channel)
+        user.channels.clear()
+        del self.connected_users[user.lower_nick]
 
-    def delete_channel(self, channel_name: str) -> None:
+    def delete_channel(self, channel: Channel) -> None:
         """
         Removes a channel from server.
         """
-        del self.channels[channel_name.lower()]
+        del self.channels[channel.lower_name]
 
 
 class ConnectionListener:
@@ -119,10 +137,16 @@ class ConnectionListener:
         Accepts incoming connections from clients.
         Starts a separate thread to handle each connection.
         """
-        print(f"Mantatail running (port {self.port})")
+        LOGGER.info("Mantatail running (port %s)", self.port)
         while True:
             (user_socket, user_address) = self.listener_socket.accept()
-            print("Got connection from", user_address)
+            # IRC lines are small and latency-sensitive, so don't let Nagle's algorithm
+            # hold them back waiting for more data. Bigger kernel buffers let bursts
+            # (motd, channel broadcasts) drain without blocking the send thread.
+            user_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            user_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            user_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+            LOGGER.info("Got connection from %s", user_address)
             client_thread = threading.Thread(
                 target=CommandReceiver, args=[self.state, user_address[0], user_socket], daemon=True
             )
@@ -147,6 +171,7 @@ class CommandReceiver:
         self.user_socket = user_socket
         self.user = UserConnection(state, user_host, user_socket)
         self.disconnect_reason: str = ""
+        self.recv_buffer = bytearray()  # Data received from the client that has not been handled yet.
 
         self.recv_loop()
 
@@ -160,9 +185,8 @@ class CommandReceiver:
 
         commands.handle_privmsg(state, user, ["#foo", "this is a message"])
 
-        The function call is done with getattr().
-        getattr(commands, "handle_join") is equivalent to commands.handle_join.
-        More info: https://docs.python.org/3/library/functions.html#getattr
+        The handler is looked up in commands.HANDLERS, a dict that maps each
+        command to its handle_* function and is built once at import time.
         """
 
         try:
@@ -172,11 +196,18 @@ class CommandReceiver:
                 if request is None:
                     return  # go to "finally:"
 
-                decoded_command = request.decode("latin-1")
-                for line in split_on_new_line(decoded_command)[:-1]:
+                # Commands from registered users are collected here and dispatched
+                # together, so a client that pipelines several commands into one
+                # chunk costs one state-lock acquisition instead of one per line.
+                pending_commands = []
+
+                # request always ends with "\n", so the last split element is empty.
+                # Most IRC clients end lines with "\r\n", but "\n" alone is accepted
+                # as well (used by e.g. netcat); the rstrip covers both.
+                for raw_line in request.split(b"\n")[:-1]:
+                    line = raw_line.rstrip(b"\r").decode("latin-1")
                     (command, args) = self.parse_received_command(line)
                     command_lower = command.lower()
-                    handler_function = "handle_" + command_lower
 
                     if self.user.nick == "*" or self.user.user_message is None or not self.user.motd_sent:
                         if command_lower == "quit":
@@ -193,16 +224,22 @@ class CommandReceiver:
                             self.user.on_registration()
 
                     else:
-                        try:
-                            # ex. "command.handle_nick" or "command.handle_join"
-                            call_handler_function = getattr(commands, handler_function)
-                        except AttributeError:
-                            errors.unknown_command(self.user, command)
-                        else:
-                            with self.state.lock:
+                        pending_commands.append((command, command_lower, args))
+                        if command_lower == "quit":
+                            # Anything the client pipelined after QUIT is thrown away.
+                            break
+
+                if pending_commands:
+                    with self.state.lock:
+                        for (command, command_lower, args) in pending_commands:
+                            # ex. commands.handle_nick or commands.handle_join
+                            call_handler_function = commands.HANDLERS.get(command_lower)
+                            if call_handler_function is None:
+                                errors.unknown_command(self.user, command)
+                            else:
                                 call_handler_function(self.state, self.user, args)
                                 if command_lower == "quit":
-                                    return
+                                    return  # go to "finally:"
 
         finally:
             self.user.send_que.put((None, self.disconnect_reason))
@@ -211,8 +248,10 @@ class CommandReceiver:
         """
         Receives one or more lines from the client as bytes and returns them to recv_loop().
 
-        It will receive until the received bytes end with "\n", which indicates that everything
-        the client has currently sent has been received.
+        Everything up to and including the last complete line ("\n") is returned;
+        a trailing partial line stays in self.recv_buffer until the rest of it arrives.
+        This way the buffer never has to be copied around while waiting for a line
+        to complete.
 
         None is returned if the user disconnects.
 
@@ -220,11 +259,14 @@ class CommandReceiver:
         after a certain time of inactivity.
         The PING message controls that the user still has an open connection to the server.
         """
-        request = b""
-        while not request.endswith(b"\n"):
+        recv_buffer = self.recv_buffer
+        # The buffer never holds a complete line between calls (everything up to
+        # the last "\n" was returned last time), so only new bytes need scanning.
+        last_newline_index = -1
+        while last_newline_index == -1:
             self.user.start_ping_timer()
             try:
-                request_chunk = self.user_socket.recv(4096)
+                request_chunk = self.user_socket.recv(65536)
             except OSError as err:
                 self.disconnect_reason = err.strerror
                 return None
@@ -232,12 +274,16 @@ class CommandReceiver:
                 self.user.ping_timer.cancel()
 
             if request_chunk:
-                request += request_chunk
+                scan_start = len(recv_buffer)
+                recv_buffer += request_chunk
+                last_newline_index = recv_buffer.rfind(b"\n", scan_start)
             else:
                 self.disconnect_reason = "Remote host closed the connection"
                 return None
 
-        return request
+        complete_lines = bytes(recv_buffer[: last_newline_index + 1])
+        del recv_buffer[: last_newline_index + 1]
+        return complete_lines
 
     def parse_received_command(self, msg: str) -> Tuple[str, List[str]]:
         """
@@ -251,17 +297,17 @@ class CommandReceiver:
             - "PRIVMSG #foo :This is a message\r\n" will send "This is a message"
             - "PRIVMSG #foo This is a message\r\n" will send "This"
         """
-        split_msg = msg.split(" ")
+        # The trailing parameter starts at the first ':' that follows a space.
+        # str.find scans for it in one pass instead of checking word by word.
+        trailing_start = msg.find(" :")
 
-        for num, arg in enumerate(split_msg):
-            if arg.startswith(":"):
-                parsed_msg = split_msg[:num]
-                parsed_msg.append(" ".join(split_msg[num:])[1:])
-                command = parsed_msg[0]
-                return command, parsed_msg[1:]
+        if trailing_start == -1:
+            split_msg = msg.split(" ")
+            return split_msg[0], split_msg[1:]
 
-        command = split_msg[0]
-        return command, split_msg[1:]
+        parsed_msg = msg[:trailing_start].split(" ")
+        parsed_msg.append(msg[trailing_start + 2 :])
+        return parsed_msg[0], parsed_msg[1:]
 
     def handle_user_registration(self, command: str, args: List[str]) -> None:
         """
@@ -277,6 +323,7 @@ class CommandReceiver:
                 self.user.user_message = args
                 self.user.user_name = args[0]
                 self.user.real_name = args[3]
+                self.user.update_user_mask()
 
         elif command == "nick":
             commands.handle_nick(self.state, self.user, args)
@@ -288,6 +335,21 @@ class CommandReceiver:
             errors.not_registered(self.user)
 
 
+class SendQueue(_SendQueueBase):
+    """
+    A queue.Queue that can also enqueue several items at once.
+
+    put_many() takes the queue's lock a single time for the whole batch,
+    instead of once per item as repeated put() calls would.
+    """
+
+    def put_many(self, items: List[QueueItem]) -> None:
+        with self.mutex:
+            self.queue.extend(items)
+            self.unfinished_tasks += len(items)
+            self.not_empty.notify()
+
+
 class UserConnection:
     """
     Represents the connection between server & client.
@@ -309,6 +371,9 @@ class UserConnection:
         All messages are sent as a tuple formatted as (message, prefix).
         Prefixes are either ":mantatail" or ":sender.user_mask"
 
+        Channel broadcasts are queued as (payload, None), where payload is the complete
+        line pre-encoded as bytes so that it can be shared between all recipients.
+
         A Tuple containing (None, disconnect_reason: str) indicates a QUIT command and closes the connection to the client.
     """
 
@@ -317,12 +382,16 @@ class UserConnection:
         self.socket = socket
         self.host = host
         self.nick = "*"
+        self.lower_nick = "*"  # The key used in State.connected_users. Updated together with nick.
         self.user_message: Optional[List[str]] = None
         self.user_name: Optional[str] = None
         self.real_name: Optional[str] = None
         self.modes = {"i"}
+        self.user_mask = f"{self.nick}!{self.user_name}@{self.host}"
         self.away: Optional[str] = None  # None = user not away, str = user away
-        self.send_que: queue.Queue[Tuple[str, str | None] | Tuple[None, str]] = queue.Queue()
+        self.channels: Set[Channel] = set()  # Kept in sync with Channel.users on JOIN/PART/KICK.
+        self.send_que: SendQueue = SendQueue()
+        self.send_buffer = bytearray()  # Reused scratch buffer for sends that need one contiguous payload.
         self.que_thread = threading.Thread(target=self.send_queue_thread)
         self.que_thread.start()
         self.cap_list: Set[str] = set()
@@ -330,9 +399,14 @@ class UserConnection:
         self.capneg_in_progress = False
         self.pong_received = False
 
-    def get_user_mask(self) -> str:
-        """Generates and returns a user mask (Nick!Username@Host)."""
-        return f"{self.nick}!{self.user_name}@{self.host}"
+    def update_user_mask(self) -> None:
+        """
+        Regenerates the user mask (Nick!Username@Host).
+
+        Must be called when the user's nick or username changes; everything else
+        reads the precomputed self.user_mask instead of formatting it per message.
+        """
+        self.user_mask = f"{self.nick}!{self.user_name}@{self.host}"
 
     def get_prefix(self, channel: Channel) -> str:
         """
@@ -360,7 +434,26 @@ class UserConnection:
     def send_queue_thread(self) -> None:
         """Queue on which the client receives messages from server."""
         while True:
-            (message, prefix) = self.send_que.get()
+            items = [self.send_que.get()]
+
+            # Messages are often queued back to back (motd, names list, channel broadcasts, etc.).
+            # Grabbing everything that is already waiting lets them be sent to the client together,
+            # instead of doing one send per message.
+            try:
+                while items[-1][0] is not None:
+                    items.append(self.send_que.get_nowait())
+            except queue.Empty:
+                pass
+
+            regular_messages = [item for item in items if item[0] is not None]
+
+            if regular_messages:
+                try:
+                    self.send_strings_to_client(regular_messages)
+                except OSError as err:
+                    self.send_que.put((None, err.strerror))
+
+            (message, prefix) = items[-1]
 
             if message is None:
                 disconnect_reason = prefix
@@ -375,37 +468,30 @@ class UserConnection:
                     if self.nick == "*" or not self.user_message:
                         self.send_string_to_client(quit_message, None)
                     else:
-                        self.send_string_to_client(quit_message, self.get_user_mask())
+                        self.send_string_to_client(quit_message, self.user_mask)
                 except OSError:
                     pass
 
                 close_socket_cleanly(self.socket)
                 return
-            else:
-                try:
-                    self.send_string_to_client(message, prefix)
-                except OSError as err:
-                    disconnect_reason = err.strerror
-                    self.send_que.put((None, disconnect_reason))
 
     def queue_quit_message_for_other_users(self, quit_message: str) -> None:
         """Alerts all other users that the User has QUIT and closed the connection to the server."""
         receivers = self.get_users_sharing_channel()
 
-        for channel in self.state.channels.values():
+        for channel in self.channels:
             channel.operators.discard(self)
 
+        item = (quit_message, self.user_mask)
         for receiver in receivers:
-            receiver.send_que.put((quit_message, self.get_user_mask()))
+            receiver.send_que.put(item)
 
     def get_users_sharing_channel(self) -> Set[UserConnection]:
         """Returns all users of all channels that this user has joined."""
-        receivers = set()
-        for channel in self.state.channels.values():
-            if self in channel.users:
-                for usr in channel.users:
-                    if usr != self:
-                        receivers.add(usr)
+        receivers: Set[UserConnection] = set()
+        for channel in self.channels:
+            receivers.update(channel.users)
+        receivers.discard(self)
         return receivers
 
     def send_string_to_client(self, message: str, prefix: Optional[str]) -> None:
@@ -414,16 +500,53 @@ class UserConnection:
 
         In most cases, you should put a message to the send queue instead of using this method directly.
         """
+        self.send_strings_to_client([(message, prefix)])
+
+    def send_strings_to_client(self, messages: List[Tuple[str | bytes, Optional[str]]]) -> None:
+        """
+        Sends one or more messages to the client with a single system call,
+        without using the send queue.
+
+        A message can also be a complete, pre-encoded line (bytes). This is used for
+        channel broadcasts, where the same payload is shared between all recipients.
+
+        In most cases, you should put messages to the send queue instead of using this method directly.
+        """
         try:
-            if prefix is None:
-                message_as_bytes = bytes(f"{message}\r\n", encoding="latin-1")
+            chunks = []
+            for (message, prefix) in messages:
+                if isinstance(message, bytes):
+                    chunks.append(message)
+                elif prefix is None:
+                    chunks.append(bytes(f"{message}\r\n", encoding="latin-1"))
+                else:
+                    chunks.append(bytes(f":{prefix} {message}\r\n", encoding="latin-1"))
+
+            if hasattr(self.socket, "sendmsg") and len(chunks) <= 1024:
+                # sendmsg() sends all messages with one system call, without first having to
+                # copy them into one big buffer. It is not available on all platforms (e.g. Windows),
+                # it may send fewer bytes than requested, and it does not accept more buffers
+                # than the platform's IOV_MAX (at least 1024 everywhere).
+                sent = self.socket.sendmsg(chunks)
+                if sent < sum(len(chunk) for chunk in chunks):
+                    self.socket.sendall(memoryview(self.fill_send_buffer(chunks))[sent:])
             else:
-                message_as_bytes = bytes(f":{prefix} {message}\r\n", encoding="latin-1")
-
-            self.socket.sendall(message_as_bytes)
+                self.socket.sendall(self.fill_send_buffer(chunks))
         except OSError:
             return
 
+    def fill_send_buffer(self, chunks: List[bytes]) -> bytearray:
+        """
+        Copies the given messages into the connection's reusable scratch buffer and returns it.
+
+        Reusing one buffer avoids allocating a new joined payload for every send.
+        """
+        send_buffer = self.send_buffer
+        send_buffer.clear()
+        for chunk in chunks:
+            send_buffer += chunk
+        return send_buffer
+
     def start_ping_timer(self) -> None:
         """
         Starts a timer on a separate thread that, when finished, sends a PING message to the client
@@ -468,12 +591,47 @@ class Channel:
 
     def __init__(self, channel_name: str, user: UserConnection) -> None:
         self.name = channel_name
+        self.lower_name = channel_name.lower()  # The key used in State.channels.
         self.topic: Optional[Tuple[str, str]] = None  # (Topic, Topic author)
         self.modes: Set[str] = {"t"}  # See State __init__ for more info on letters.
         self.operators: Set[UserConnection] = set()
-        self.users: Set[UserConnection] = set()
+        # Broadcasts iterate the members constantly, so they are stored in a list
+        # (contiguous, cache-friendly) with a dict giving each member's index for
+        # O(1) membership tests and removal (see remove_user).
+        self.users: List[UserConnection] = []
+        self.user_indexes: Dict[UserConnection, int] = {}
         self.ban_list: Dict[str, str] = {}
         self.operators.add(user)
+        # Every member's nick with their operator prefix (ex. "@Alice", "Bob").
+        # Kept in sync on JOIN/PART/KICK, nick changes and MODE +o/-o, so that
+        # names replies don't have to re-check operator status per member.
+        self.prefixed_nicks: Dict[UserConnection, str] = {}
+
+    def has_user(self, user: UserConnection) -> bool:
+        """Checks if a user is a member of the channel."""
+        return user in self.user_indexes
+
+    def add_user(self, user: UserConnection) -> None:
+        """Adds a user to the channel's members. Does nothing if they already are one."""
+        if user not in self.user_indexes:
+            self.user_indexes[user] = len(self.users)
+            self.users.append(user)
+
+    def remove_user(self, user: UserConnection) -> None:
+        """
+        Removes a user from the channel's members. Does nothing if they are not one.
+
+        The last member is swapped into the removed member's list slot, so removal
+        doesn't have to shift the rest of the list. Member order doesn't matter.
+        """
+        index = self.user_indexes.pop(user, None)
+        if index is None:
+            return
+
+        last_user = self.users.pop()
+        if last_user is not user:
+            self.users[index] = last_user
+            self.user_indexes[last_user] = index
 
     def set_topic(self, user: UserConnection, topic: str) -> None:
         if not topic:
@@ -489,8 +647,7 @@ class Channel:
             topic_message = f"332 {user.nick} {self.name} :{self.topic[0]}"
             author_message = f"333 {user.nick} {self.name} :{self.topic[1]}"
 
-            user.send_que.put((topic_message, "mantatail"))
-            user.send_que.put((author_message, "mantatail"))
+            user.send_que.put_many([(topic_message, "mantatail"), (author_message, "mantatail")])
 
     def queue_message_to_chan_users(self, message: str, sender: UserConnection, send_to_self: bool = True) -> None:
         """
@@ -499,9 +656,14 @@ class Channel:
         In cases where the message should not be sent to self (ex. PRIVMSG), the method
         is called with send_to_self = False.
         """
+        # Encoding the full line once here means it doesn't have to be formatted
+        # and encoded again for every recipient, and the queue item tuple can be
+        # shared between all recipient queues as well.
+        payload = bytes(f":{sender.user_mask} {message}\r\n", encoding="latin-1")
+        item = (payload, None)
         for usr in self.users:
-            if usr != sender or send_to_self:
-                usr.send_que.put((message, sender.get_user_mask()))
+            if usr is not sender or send_to_self:
+                usr.send_que.put(item)
 
     def check_if_banned(self, target: str) -> bool:
         """
@@ -511,7 +673,7 @@ class Channel:
         Wildcards "*" are used to cover any set of characters.
         Ex. If the ban list contains "*!Bar@Baz", "Foo!Bar@Baz" will be considered a match.
         """
-        return any(fnmatch.fnmatch(target, ban_mask) for ban_mask in self.ban_list.keys())
+        return any(fnmatch.fnmatch(target, ban_mask) for ban_mask in self.ban_list)
 
 
 def close_socket_cleanly(sock: socket.socket) -> None:
@@ -536,14 +698,6 @@ def close_socket_cleanly(sock: socket.socket) -> None:
     sock.close()
 
 
-def split_on_new_line(string: str) -> List[str]:
-    """Splits a message received by a client on "\r\n" (most IRC clients) or "\n" (e.g. Netcat)."""
-    if string.endswith("\r\n"):
-        return string.split("\r\n")
-    else:
-        return string.split("\n")
-
-
 def get_motd_content_from_json() -> Optional[Dict[str, List[str]]]:
     """Loads the Message of the Day file.
 
@@ -558,4 +712,7 @@ def get_motd_content_from_json() -> Optional[Dict[str, List[str]]]:
 
 
 if __name__ == "__main__":
+    # Bare-message format keeps the output identical to the old print() calls,
+    # which the fuzzer's output parsing relies on.
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     ConnectionListener(6667, get_motd_content_from_json()).run_server_forever()
@@ -1,7 +1,7 @@
 import pytest
 import threading
-import traceback
 import socket
+import weakref
 
 from server import ConnectionListener
 
@@ -21,7 +21,7 @@ motd_dict_test = {
 # fmt: on
 
 # Based on: https://gist.github.com/sbrugman/59b3535ebcd5aa0e2598293cfa58b6ab#gistcomment-3795790
-@pytest.fixture
+@pytest.fixture(autouse=True)
 def fail_test_if_there_is_an_error_in_a_thread(monkeypatch):
     last_exception = None
 
@@ -30,7 +30,8 @@ def fail_test_if_there_is_an_error_in_a_thread(monkeypatch):
             try:
                 super().run()
             except Exception as e:
-                traceback.print_exc()
+                # No traceback print here: pytest renders the full traceback when
+                # the exception is re-raised at fixture teardown below.
                 nonlocal last_exception
                 last_exception = e
 
@@ -40,9 +41,17 @@ def fail_test_if_there_is_an_error_in_a_thread(monkeypatch):
         raise last_exception
 
 
-@pytest.fixture
-def run_server(fail_test_if_there_is_an_error_in_a_thread):
-    listener = ConnectionListener(6667, motd_dict_test)
+@pytest.fixture(scope="session")
+def run_server():
+    """
+    Starts one server for the whole test session and returns its port.
+
+    Port 0 makes the OS pick a free port, so parallel test sessions don't fight
+    over a fixed one. Every test's clients QUIT (and are thereby deleted from the
+    server state) before the next test starts, which keeps tests isolated.
+    """
+    listener = ConnectionListener(0, motd_dict_test)
+    port = listener.listener_socket.getsockname()[1]
 
     def run_server():
         try:
@@ -52,7 +61,7 @@ def run_server(fail_test_if_there_is_an_error_in_a_thread):
 
     threading.Thread(target=run_server).start()
 
-    yield
+    yield port
 
     # .shutdown() raises an OSError on mac, removing it makes the test suite freeze on linux.
     try:
@@ -65,18 +74,21 @@ def run_server(fail_test_if_there_is_an_error_in_a_thread):
 @pytest.fixture
 def user_alice(run_server, helpers):
     alice_socket = socket.socket()
-    alice_socket.connect(("localhost", 6667))
-    alice_socket.sendall(b"NICK Alice\r\n")
-    alice_socket.sendall(b"USER AliceUsr 0 * :Alice's real name\r\n")
+    alice_socket.connect(("localhost", run_server))
+    alice_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    alice_socket.sendall(b"NICK Alice\r\nUSER AliceUsr 0 * :Alice's real name\r\n")
 
     # Receiving everything the server is going to send helps prevent errors.
     # Otherwise it might not be fully started yet when the client quits.
-    while helpers.receive_line(alice_socket) != b":mantatail 376 Alice :End of /MOTD command\r\n":
-        pass
+    helpers.drain_until(alice_socket, b":mantatail 376 Alice :End of /MOTD command")
 
     yield alice_socket
+    # Half-closing after QUIT lets the server finish the disconnect on its own;
+    # draining to EOF is cheaper than searching the backlog for the QUIT echo,
+    # and EOF still guarantees the server has deleted the user.
     alice_socket.sendall(b"QUIT\r\n")
-    while b"QUIT" not in helpers.receive_line(alice_socket):
+    alice_socket.shutdown(socket.SHUT_WR)
+    while alice_socket.recv(4096):
         pass
     alice_socket.close()
 
@@ -84,18 +96,21 @@ def user_alice(run_server, helpers):
 @pytest.fixture
 def user_bob(run_server, helpers):
     bob_socket = socket.socket()
-    bob_socket.connect(("localhost", 6667))
-    bob_socket.sendall(b"NICK Bob\r\n")
-    bob_socket.sendall(b"USER BobUsr 0 * :Bob's real name\r\n")
+    bob_socket.connect(("localhost", run_server))
+    bob_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    bob_socket.sendall(b"NICK Bob\r\nUSER BobUsr 0 * :Bob's real name\r\n")
 
     # Receiving everything the server is going to send helps prevent errors.
     # Otherwise it might not be fully started yet when the client quits.
-    while helpers.receive_line(bob_socket) != b":mantatail 376 Bob :End of /MOTD command\r\n":
-        pass
+    helpers.drain_until(bob_socket, b":mantatail 376 Bob :End of /MOTD command")
 
     yield bob_socket
+    # Half-closing after QUIT lets the server finish the disconnect on its own;
+    # draining to EOF is cheaper than searching the backlog for the QUIT echo,
+    # and EOF still guarantees the server has deleted the user.
     bob_socket.sendall(b"QUIT\r\n")
-    while b"QUIT" not in helpers.receive_line(bob_socket):
+    bob_socket.shutdown(socket.SHUT_WR)
+    while bob_socket.recv(4096):
         pass
     bob_socket.close()
 
@@ -103,31 +118,104 @@ def user_bob(run_server, helpers):
 @pytest.fixture
 def user_charlie(run_server, helpers):
     charlie_socket = socket.socket()
-    charlie_socket.connect(("localhost", 6667))
-    charlie_socket.sendall(b"NICK Charlie\r\n")
-    charlie_socket.sendall(b"USER CharlieUsr 0 * :Charlie's real name\r\n")
+    charlie_socket.connect(("localhost", run_server))
+    charlie_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    charlie_socket.sendall(b"NICK Charlie\r\nUSER CharlieUsr 0 * :Charlie's real name\r\n")
 
     # Receiving everything the server is going to send helps prevent errors.
     # Otherwise it might not be fully started yet when the client quits.
-    while helpers.receive_line(charlie_socket) != b":mantatail 376 Charlie :End of /MOTD command\r\n":
-        pass
+    helpers.drain_until(charlie_socket, b":mantatail 376 Charlie :End of /MOTD command")
 
     yield charlie_socket
+    # Half-closing after QUIT lets the server finish the disconnect on its own;
+    # draining to EOF is cheaper than searching the backlog for the QUIT echo,
+    # and EOF still guarantees the server has deleted the user.
     charlie_socket.sendall(b"QUIT\r\n")
-    while b"QUIT" not in helpers.receive_line(charlie_socket):
+    charlie_socket.shutdown(socket.SHUT_WR)
+    while charlie_socket.recv(4096):
         pass
     charlie_socket.close()
 
 
+class LineReader:
+    """
+    Buffered reader of "\r\n"-terminated lines.
+
+    Receives from the socket in big chunks and slices lines out of an internal
+    buffer, instead of paying one recv() system call per byte.
+
+    recv_into() appends in place in a preallocated buffer (no per-chunk bytes
+    object), and already-searched data is never scanned for "\r\n" again.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray(65536)
+        self.read_pos = 0  # Start of data that hasn't been returned as a line yet.
+        self.write_pos = 0  # End of received data.
+        self.scan_pos = 0  # How far the search for "\r\n" has come.
+
+    def read_line(self, timeout):
+        self.sock.settimeout(timeout)
+        while True:
+            line_end = self.buffer.find(b"\r\n", self.scan_pos, self.write_pos)
+            if line_end != -1:
+                line = bytes(self.buffer[self.read_pos : line_end + 2])
+                self.read_pos = self.scan_pos = line_end + 2
+                return line
+
+            # Everything received so far has been searched. The last byte may still
+            # be the "\r" of a "\r\n" split between two chunks, so back off by one.
+            self.scan_pos = max(self.read_pos, self.write_pos - 1)
+
+            if self.write_pos == len(self.buffer):
+                self.make_room()
+
+            received = self.sock.recv_into(memoryview(self.buffer)[self.write_pos :])
+            if not received:
+                raise ConnectionError("server closed the connection")
+            self.write_pos += received
+
+    def make_room(self):
+        """Shifts unread data to the front of the buffer, or grows it if already there."""
+        if self.read_pos > 0:
+            remaining = self.write_pos - self.read_pos
+            self.buffer[:remaining] = self.buffer[self.read_pos : self.write_pos]
+            self.scan_pos -= self.read_pos
+            self.read_pos = 0
+            self.write_pos = remaining
+        else:
+            # A single line is bigger than the whole buffer; double it.
+            self.buffer.extend(bytes(len(self.buffer)))
+
+
 # Based on https://stackoverflow.com/a/42156088/15382873
 class Helpers:
-    @staticmethod
-    def receive_line(sock, timeout=1):
-        sock.settimeout(timeout)
-        received = b""
-        while not received.endswith(b"\r\n"):
-            received += sock.recv(1)
-        return received
+    # socket.socket defines __slots__, so the per-socket readers live here instead
+    # of on the socket objects. Weak keys let sockets be garbage collected normally.
+    _line_readers = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def reader_for(cls, sock):
+        reader = cls._line_readers.get(sock)
+        if reader is None:
+            reader = cls._line_readers[sock] = LineReader(sock)
+        return reader
+
+    @classmethod
+    def receive_line(cls, sock, timeout=1):
+        return cls.reader_for(sock).read_line(timeout)
+
+    @classmethod
+    def drain_until(cls, sock, needle, timeout=1):
+        """
+        Reads and throws away lines until one containing needle arrives.
+
+        Waiting for an observable event (ex. one's own JOIN echo) instead of
+        sleeping for a fixed time keeps tests fast and not timing-dependent.
+        """
+        while needle not in cls.receive_line(sock, timeout):
+            pass
 
     # Makes it easier to assert bytes received from Sets
     @staticmethod
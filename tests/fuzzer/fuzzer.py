@@ -65,6 +65,10 @@ words = [
     ":",
 ]
 
+# Encoded once; the fuzzing loop works on bytes so each burst is built without
+# re-encoding or concatenating str objects.
+words_as_bytes = [word.encode() for word in words]
+
 # Example of what Mantatail prints:
 #
 #    Got connection from ('127.0.0.1', 33224)
@@ -129,16 +133,18 @@ def output_reading_thread():
 def fuzzing_loop():
     print("Fuzzing...")
     while True:
-        commands = ""
+        commands = bytearray()
         for line_number in range(500):
             words_per_line = random.randint(1, 5)
-            chosen_words = [random.choice(words) for word_number in range(words_per_line)]
-            commands += " ".join(chosen_words) + "\n"
+            commands += b" ".join(random.choices(words_as_bytes, k=words_per_line))
+            commands += b"\n"
 
+        # One connection per burst, so that a crash can be traced back to the
+        # burst's commands via its address tuple (see print_commands above).
         sock = socket.socket()
         sock.connect(("localhost", 6667))
-        recent_commands.append((sock.getsockname(), commands))
-        sock.sendall(commands.encode())
+        recent_commands.append((sock.getsockname(), commands.decode()))
+        sock.sendall(commands)
 
         try:
             sock.shutdown(socket.SHUT_RDWR)
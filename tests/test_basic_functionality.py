@@ -1,19 +1,22 @@
-import os
+import select
 import sys
 import pytest
-import random
 import socket
-import time
 
 import server
 
+# 100 bytes that are not valid utf-8 (0xAA is a lone continuation byte), with no
+# "\r" or "\n" in them (the values 0x0D ^ 0xAA and 0x0A ^ 0xAA are both > 99).
+# A fixed blob keeps the test reproducible and avoids an os.urandom system call.
+INVALID_UTF8_MESSAGE = bytes(i ^ 0xAA for i in range(100))
+EXPECTED_INVALID_UTF8_PRIVMSG = b":Alice!AliceUsr@127.0.0.1 PRIVMSG #foo :" + INVALID_UTF8_MESSAGE + b"\r\n"
+
 
 def test_server_sends_ping(monkeypatch, user_alice, helpers):
     monkeypatch.setattr(server, "PING_TIMER_SECS", 2)
     user_alice.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice, 3) != b"PING :mantatail\r\n":
-        pass
+    helpers.drain_until(user_alice, b"PING :mantatail", 3)
 
     user_alice.sendall(b"PONG :mantatail\r\n")
 
@@ -28,26 +31,22 @@ def test_client_sends_ping(user_alice, helpers):
 
 def test_join_channel(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
     assert helpers.receive_line(user_bob) == b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n"
 
-    while helpers.receive_line(user_bob) != b":mantatail 353 Bob = #foo :Bob @Alice\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_bob, b":mantatail 353 Bob = #foo :Bob @Alice")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
 
 def test_nick_change(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_alice.sendall(b"NICK :NewNick\r\n")
     assert helpers.receive_line(user_alice) == b":Alice!AliceUsr@127.0.0.1 NICK :NewNick\r\n"
@@ -78,24 +77,20 @@ def test_nick_change(user_alice, user_bob, helpers):
 
 def test_send_privmsg(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
-    user_bob.sendall(b"PRIVMSG #foo :Foo\r\n")
-    assert helpers.receive_line(user_alice) == b":Bob!BobUsr@127.0.0.1 PRIVMSG #foo :Foo\r\n"
+    # Each client's messages are pipelined in one send; per-sender order is
+    # preserved, so the asserts below still see them in order.
+    user_bob.sendall(b"PRIVMSG #foo :Foo\r\nPRIVMSG #foo :Foo Bar\r\n")
+    user_alice.sendall(b"PRIVMSG #foo Bar\r\nPRIVMSG #foo Foo Bar\r\n")
 
-    user_alice.sendall(b"PRIVMSG #foo Bar\r\n")
-    assert helpers.receive_line(user_bob) == b":Alice!AliceUsr@127.0.0.1 PRIVMSG #foo :Bar\r\n"
-
-    user_bob.sendall(b"PRIVMSG #foo :Foo Bar\r\n")
+    assert helpers.receive_line(user_alice) == b":Bob!BobUsr@127.0.0.1 PRIVMSG #foo :Foo\r\n"
     assert helpers.receive_line(user_alice) == b":Bob!BobUsr@127.0.0.1 PRIVMSG #foo :Foo Bar\r\n"
-
-    user_alice.sendall(b"PRIVMSG #foo Foo Bar\r\n")
+    assert helpers.receive_line(user_bob) == b":Alice!AliceUsr@127.0.0.1 PRIVMSG #foo :Bar\r\n"
     assert helpers.receive_line(user_bob) == b":Alice!AliceUsr@127.0.0.1 PRIVMSG #foo :Foo\r\n"
 
 
@@ -140,13 +135,11 @@ def test_away_status(user_alice, user_bob, helpers):
 
 def test_who_command(user_alice, user_bob, user_charlie, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_bob.sendall(b"AWAY :I am away\r\n")
     assert helpers.receive_line(user_bob) == b":mantatail 306 Bob :You have been marked as being away\r\n"
@@ -155,8 +148,7 @@ def test_who_command(user_alice, user_bob, user_charlie, helpers):
     assert helpers.receive_line(user_charlie) == b":mantatail 315 Charlie #foo :End of /WHO list.\r\n"
 
     user_charlie.sendall(b"JOIN #foo\r\n")
-    while helpers.receive_line(user_charlie) != b":mantatail 366 Charlie #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_charlie, b":mantatail 366 Charlie #foo :End of /NAMES list.")
 
     WHO_MESSAGES = [
         b":mantatail 352 Charlie #foo AliceUsr 127.0.0.1 Mantatail Alice H@ :0 Alice's real name\r\n",
@@ -217,8 +209,7 @@ def test_send_privmsg_to_user(user_alice, user_bob, helpers):
 def test_channel_mode_is(user_alice, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":mantatail 366 Alice #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":mantatail 366 Alice #foo :End of /NAMES list.")
 
     user_alice.sendall(b"MODE #foo\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 324 Alice #foo +t\r\n"
@@ -227,46 +218,39 @@ def test_channel_mode_is(user_alice, helpers):
 def test_join_part_race_condition(user_alice, user_bob, helpers):
     for i in range(100):
         user_alice.sendall(b"JOIN #foo\r\n")
-        time.sleep(random.randint(0, 10) / 1000)
         user_alice.sendall(b"PART #foo\r\n")
         user_bob.sendall(b"JOIN #foo\r\n")
-        time.sleep(random.randint(0, 10) / 1000)
         user_bob.sendall(b"PART #foo\r\n")
 
 
 # Issue #77
-def test_disconnecting_without_sending_anything(user_alice):
+def test_disconnecting_without_sending_anything(run_server, user_alice, helpers):
     user_alice.send(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     nc = socket.socket()
-    nc.connect(("localhost", 6667))
+    nc.connect(("localhost", run_server))
     nc.close()
 
 
 def test_invalid_utf8(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
-    random_message = os.urandom(100).replace(b"\n", b"")
-    user_alice.sendall(b"PRIVMSG #foo :" + random_message + b"\r\n")
-    assert helpers.receive_line(user_bob) == b":Alice!AliceUsr@127.0.0.1 PRIVMSG #foo :" + random_message + b"\r\n"
+    user_alice.sendall(b"PRIVMSG #foo :" + INVALID_UTF8_MESSAGE + b"\r\n")
+    assert helpers.receive_line(user_bob) == EXPECTED_INVALID_UTF8_PRIVMSG
 
 
 def test_message_starting_with_colon(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     # Alice sends ":O lolwat" to Bob.
     # It is prefixed with a second ":" because of how IRC works.
@@ -282,16 +266,20 @@ def test_message_starting_with_colon(user_alice, user_bob, helpers):
 # netcat sends \n line endings, but is fine receiving \r\n
 def test_connect_via_netcat(run_server, helpers):
     with socket.socket() as nc:
-        nc.connect(("localhost", 6667))  # nc localhost 6667
+        nc.connect(("localhost", run_server))
         nc.sendall(b"NICK nc\n")
         nc.sendall(b"USER nc 0 * :netcat\n")
-        while helpers.receive_line(nc) != b":mantatail 376 nc :End of /MOTD command\r\n":
-            pass
+        helpers.drain_until(nc, b":mantatail 376 nc :End of /MOTD command")
+
+        # Waiting for the QUIT echo guarantees the server has deleted the user,
+        # so later tests can use the same nick.
+        nc.sendall(b"QUIT\n")
+        helpers.drain_until(nc, b":nc!nc@127.0.0.1 QUIT")
 
 
 def test_on_registration_messages(run_server, helpers):
     nc = socket.socket()
-    nc.connect(("localhost", 6667))
+    nc.connect(("localhost", run_server))
     nc.sendall(b"NICK nc\n")
     nc.sendall(b"USER nc 0 * :netcat\n")
 
@@ -303,13 +291,18 @@ def test_on_registration_messages(run_server, helpers):
     assert b":mantatail 005 nc" in line
     assert b":are supported by this server" in line
 
-    while helpers.receive_line(nc) != b":mantatail 376 nc :End of /MOTD command\r\n":
-        pass
+    helpers.drain_until(nc, b":mantatail 376 nc :End of /MOTD command")
+
+    # Waiting for the QUIT echo guarantees the server has deleted the user,
+    # so later tests can use the same nick.
+    nc.sendall(b"QUIT\n")
+    helpers.drain_until(nc, b":nc!nc@127.0.0.1 QUIT")
+    nc.close()
 
 
 def test_cap_commands(run_server, helpers):
     nc = socket.socket()
-    nc.connect(("localhost", 6667))
+    nc.connect(("localhost", run_server))
 
     nc.sendall(b"CAP\n")
     assert helpers.receive_line(nc) == b":mantatail 461 * CAP :Not enough parameters\r\n"
@@ -333,13 +326,18 @@ def test_cap_commands(run_server, helpers):
         helpers.receive_line(nc)
 
     nc.sendall(b"CAP END\n")
-    while helpers.receive_line(nc) != b":mantatail 376 nc :End of /MOTD command\r\n":
-        pass
+    helpers.drain_until(nc, b":mantatail 376 nc :End of /MOTD command")
+
+    # Waiting for the QUIT echo guarantees the server has deleted the user,
+    # so later tests can use the same nick.
+    nc.sendall(b"QUIT\n")
+    helpers.drain_until(nc, b":nc!nc@127.0.0.1 QUIT")
+    nc.close()
 
 
 def test_cap_req(run_server, helpers):
     nc = socket.socket()
-    nc.connect(("localhost", 6667))
+    nc.connect(("localhost", run_server))
     nc.sendall(b"CAP LS\n")
     assert helpers.receive_line(nc) == b":mantatail CAP * LS :away-notify cap-notify\r\n"
 
@@ -382,7 +380,7 @@ def test_cap_req(run_server, helpers):
 
 def test_away_notify(run_server, helpers):
     nc = socket.socket()
-    nc.connect(("localhost", 6667))
+    nc.connect(("localhost", run_server))
     nc.sendall(b"CAP LS\n")
     assert helpers.receive_line(nc) == b":mantatail CAP * LS :away-notify cap-notify\r\n"
 
@@ -391,12 +389,11 @@ def test_away_notify(run_server, helpers):
     nc.sendall(b"CAP END\n")
     nc.sendall(b"JOIN #foo\n")
 
-    while helpers.receive_line(nc) != b":mantatail 366 nc #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(nc, b":mantatail 366 nc #foo :End of /NAMES list.")
 
     # Negotiates away-notify with server
     nc2 = socket.socket()
-    nc2.connect(("localhost", 6667))
+    nc2.connect(("localhost", run_server))
     nc2.sendall(b"CAP REQ away-notify\n")
     assert helpers.receive_line(nc2) == b":mantatail CAP * ACK :away-notify\r\n"
     nc2.sendall(b"NICK nc2\n")
@@ -404,25 +401,22 @@ def test_away_notify(run_server, helpers):
     nc2.sendall(b"CAP END\n")
     nc2.sendall(b"JOIN #foo\n")
 
-    while helpers.receive_line(nc2) != b":mantatail 366 nc2 #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(nc2, b":mantatail 366 nc2 #foo :End of /NAMES list.")
 
     # Does not negotiate with server
     nc3 = socket.socket()
-    nc3.connect(("localhost", 6667))
+    nc3.connect(("localhost", run_server))
     nc3.sendall(b"NICK nc3\n")
     nc3.sendall(b"USER nc3 0 * :netcat\n")
     nc3.sendall(b"JOIN #foo\n")
 
-    while helpers.receive_line(nc3) != b":mantatail 366 nc3 #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(nc3, b":mantatail 366 nc3 #foo :End of /NAMES list.")
 
-    # Join messages from other clients
+    # Join messages from other clients. Receiving them also guarantees that the
+    # server has fully processed the joins before the AWAY below is sent.
     helpers.receive_line(nc)
     helpers.receive_line(nc2)
 
-    time.sleep(0.1)
-
     nc.sendall(b"AWAY :This is an away message\n")
 
     assert helpers.receive_line(nc2) == b":nc!nc@127.0.0.1 AWAY :This is an away message\r\n"
@@ -432,7 +426,7 @@ def test_away_notify(run_server, helpers):
         helpers.receive_line(nc3)
 
     nc4 = socket.socket()
-    nc4.connect(("localhost", 6667))
+    nc4.connect(("localhost", run_server))
     nc4.sendall(b"NICK nc4\n")
     nc4.sendall(b"USER nc4 0 * :netcat\n")
 
@@ -440,8 +434,7 @@ def test_away_notify(run_server, helpers):
 
     nc4.sendall(b"JOIN #foo\n")
 
-    while helpers.receive_line(nc2) != b":nc4!nc4@127.0.0.1 AWAY :I am away\r\n":
-        pass
+    helpers.drain_until(nc2, b":nc4!nc4@127.0.0.1 AWAY :I am away")
 
     assert b"JOIN" in helpers.receive_line(nc3)  # nc4 JOIN message
 
@@ -449,53 +442,56 @@ def test_away_notify(run_server, helpers):
     with pytest.raises(socket.timeout):
         helpers.receive_line(nc3)
 
+    # Waiting for each QUIT echo guarantees the server has deleted the users,
+    # so later tests can use the same nicks.
+    for number, nc_socket in enumerate([nc, nc2, nc3, nc4], start=1):
+        nick = b"nc" if number == 1 else b"nc%d" % number
+        nc_socket.sendall(b"QUIT\n")
+        helpers.drain_until(nc_socket, b":" + nick + b"!" + nick + b"@127.0.0.1 QUIT")
+        nc_socket.close()
+
 
 def test_quit_before_registering(run_server, helpers):
     with socket.socket() as nc:
-        nc.connect(("localhost", 6667))  # nc localhost 6667
+        nc.connect(("localhost", run_server))
         nc.sendall(b"QUIT\n")
         assert helpers.receive_line(nc) == b"QUIT :Quit: Client quit\r\n"
 
 
 def test_quit_reasons(run_server, helpers):
     nc = socket.socket()
-    nc.connect(("localhost", 6667))
+    nc.connect(("localhost", run_server))
     nc.sendall(b"NICK nc\n")
     nc.sendall(b"USER nc 0 * :netcat\n")
     nc.sendall(b"JOIN #foo\n")
 
-    while helpers.receive_line(nc) != b":mantatail 366 nc #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(nc, b":mantatail 366 nc #foo :End of /NAMES list.")
 
     nc2 = socket.socket()
-    nc2.connect(("localhost", 6667))
+    nc2.connect(("localhost", run_server))
     nc2.sendall(b"NICK nc2\n")
     nc2.sendall(b"USER nc2 0 * :netcat\n")
     nc2.sendall(b"JOIN #foo\n")
 
-    while helpers.receive_line(nc2) != b":mantatail 366 nc2 #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(nc2, b":mantatail 366 nc2 #foo :End of /NAMES list.")
 
     nc3 = socket.socket()
-    nc3.connect(("localhost", 6667))
+    nc3.connect(("localhost", run_server))
     nc3.sendall(b"NICK nc3\n")
     nc3.sendall(b"USER nc3 0 * :netcat\n")
     nc3.sendall(b"JOIN #foo\n")
 
-    while helpers.receive_line(nc3) != b":mantatail 366 nc3 #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(nc3, b":mantatail 366 nc3 #foo :End of /NAMES list.")
 
     nc4 = socket.socket()
-    nc4.connect(("localhost", 6667))
+    nc4.connect(("localhost", run_server))
     nc4.sendall(b"NICK nc4\n")
     nc4.sendall(b"USER nc4 0 * :netcat\n")
     nc4.sendall(b"JOIN #foo\n")
 
-    while helpers.receive_line(nc4) != b":mantatail 366 nc4 #foo :End of /NAMES list.\r\n":
-        pass
-
-    time.sleep(0.1)
+    helpers.drain_until(nc4, b":mantatail 366 nc4 #foo :End of /NAMES list.")
 
+    # nc4 joined last, so its names reply above means everyone is on the channel.
     nc.sendall(b"QUIT\n")
     assert helpers.receive_line(nc4) == b":nc!nc@127.0.0.1 QUIT :Quit: Client quit\r\n"
 
@@ -511,23 +507,25 @@ def test_quit_reasons(run_server, helpers):
 
 def test_sudden_disconnect(run_server, helpers):
     nc = socket.socket()
-    nc.connect(("localhost", 6667))
+    nc.connect(("localhost", run_server))
     nc.sendall(b"NICK nc\n")
     nc.sendall(b"USER nc 0 * :netcat\n")
     nc.sendall(b"JOIN #foo\n")
 
-    while helpers.receive_line(nc) != b":mantatail 366 nc #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(nc, b":mantatail 366 nc #foo :End of /NAMES list.")
 
     nc2 = socket.socket()
-    nc2.connect(("localhost", 6667))
+    nc2.connect(("localhost", run_server))
     nc2.sendall(b"NICK nc2\n")
     nc2.sendall(b"USER nc2 0 * :netcat\n")
     nc2.sendall(b"JOIN #foo\n")
 
-    while helpers.receive_line(nc2) != b":mantatail 366 nc2 #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(nc2, b":mantatail 366 nc2 #foo :End of /NAMES list.")
 
+    # Wait for nc2's JOIN message to arrive at nc's socket without reading it.
+    # Closing with unread data makes the kernel reset the connection, so the
+    # server reliably sees "Connection reset by peer" instead of a clean EOF.
+    select.select([nc], [], [], 5)
     nc.close()
 
     if sys.platform == "win32":
@@ -535,3 +533,7 @@ def test_sudden_disconnect(run_server, helpers):
         assert helpers.receive_line(nc2).startswith(b":nc!nc@127.0.0.1 QUIT :Quit: ")
     else:
         assert helpers.receive_line(nc2) == b":nc!nc@127.0.0.1 QUIT :Quit: Connection reset by peer\r\n"
+
+    nc2.sendall(b"QUIT\n")
+    helpers.drain_until(nc2, b":nc2!nc2@127.0.0.1 QUIT")
+    nc2.close()
@@ -4,7 +4,7 @@ import time
 
 def test_join_before_registering(run_server, helpers):
     user_socket = socket.socket()
-    user_socket.connect(("localhost", 6667))
+    user_socket.connect(("localhost", run_server))
     user_socket.sendall(b"JOIN #foo\r\n")
     assert helpers.receive_line(user_socket) == b":mantatail 451 * :You have not registered\r\n"
 
@@ -16,7 +16,7 @@ def test_no_such_channel(user_alice, helpers):
 
 def test_youre_not_on_that_channel(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)  # TODO: wait until server says that join is done
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"PART #foo\r\n")
 
     assert helpers.receive_line(user_bob) == b":mantatail 442 Bob #foo :You're not on that channel\r\n"
@@ -24,9 +24,7 @@ def test_youre_not_on_that_channel(user_alice, user_bob, helpers):
 
 def test_privmsg_error_messages(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    while helpers.receive_line(user_alice) != b":mantatail 366 Alice #foo :End of /NAMES list.\r\n":
-        pass
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":mantatail 366 Alice #foo :End of /NAMES list.")
 
     user_bob.sendall(b"PRIVMSG #foo :Bar\r\n")
     assert helpers.receive_line(user_bob) == b":mantatail 442 Bob #foo :You're not on that channel\r\n"
@@ -44,115 +42,102 @@ def test_privmsg_error_messages(user_alice, user_bob, helpers):
     assert helpers.receive_line(user_alice) == b":mantatail 401 Alice Charlie :No such nick/channel\r\n"
 
 
-def test_not_enough_params_error(user_alice, helpers):
+def test_not_enough_params_error(run_server, user_alice, helpers):
     user_alice.sendall(b"JOIN\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 461 Alice JOIN :Not enough parameters\r\n"
 
     user_alice.sendall(b"JOIN #foo\r\n")
-    while helpers.receive_line(user_alice) != b":mantatail 366 Alice #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":mantatail 366 Alice #foo :End of /NAMES list.")
 
-    user_alice.sendall(b"part\r\n")
+    # Pipelined in one send; the replies come back in command order.
+    user_alice.sendall(b"part\r\nMode\r\nKICK\r\nKICK Bob\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 461 Alice PART :Not enough parameters\r\n"
-
-    user_alice.sendall(b"Mode\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 461 Alice MODE :Not enough parameters\r\n"
-
-    user_alice.sendall(b"KICK\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 461 Alice KICK :Not enough parameters\r\n"
-
-    user_alice.sendall(b"KICK Bob\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 461 Alice KICK :Not enough parameters\r\n"
 
     nc = socket.socket()
-    nc.connect(("localhost", 6667))
+    nc.connect(("localhost", run_server))
 
     nc.sendall(b"USER\n")
     assert helpers.receive_line(nc) == b":mantatail 461 * USER :Not enough parameters\r\n"
 
     nc.sendall(b"QUIT\r\n")
-    while b"QUIT" not in helpers.receive_line(nc):
-        pass
+    helpers.drain_until(nc, b"QUIT")
     nc.close()
 
 
 def test_send_unknown_commands(user_alice, helpers):
-    user_alice.sendall(b"FOO\r\n")
+    # Pipelined in one send; the replies come back in command order.
+    user_alice.sendall(b"FOO\r\nBar\r\nbaz\r\n&/!\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 421 Alice FOO :Unknown command\r\n"
-    user_alice.sendall(b"Bar\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 421 Alice Bar :Unknown command\r\n"
-    user_alice.sendall(b"baz\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 421 Alice baz :Unknown command\r\n"
-    user_alice.sendall(b"&/!\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 421 Alice &/! :Unknown command\r\n"
 
 
 ### Netcat tests
 def test_no_nickname_given(run_server, helpers):
     with socket.socket() as nc:
-        nc.connect(("localhost", 6667))
+        nc.connect(("localhost", run_server))
         nc.sendall(b"NICK\r\n")
         assert helpers.receive_line(nc) == b":mantatail 431 :No nickname given\r\n"
 
 
 def test_nick_already_taken(run_server, helpers):
     nc = socket.socket()
-    nc.connect(("localhost", 6667))
+    nc.connect(("localhost", run_server))
     nc.sendall(b"NICK nc\n")
     nc.sendall(b"USER nc 0 * :netcat\n")
 
-    while helpers.receive_line(nc) != b":mantatail 376 nc :End of /MOTD command\r\n":
-        pass
+    helpers.drain_until(nc, b":mantatail 376 nc :End of /MOTD command")
 
     nc2 = socket.socket()
-    nc2.connect(("localhost", 6667))
+    nc2.connect(("localhost", run_server))
     nc2.sendall(b"NICK nc\n")
     assert helpers.receive_line(nc2) == b":mantatail 433 * nc :Nickname is already in use\r\n"
 
     nc.sendall(b"QUIT\r\n")
-    while b"QUIT" not in helpers.receive_line(nc):
-        pass
+    helpers.drain_until(nc, b"QUIT")
     nc.close()
 
-    time.sleep(0.1)
-
+    # The QUIT echo above is only sent after the server has deleted the user,
+    # so the nick is guaranteed to be free again here.
     nc2.sendall(b"NICK nc\n")
     nc2.sendall(b"USER nc 0 * :netcat\n")
 
-    while helpers.receive_line(nc2) != b":mantatail 376 nc :End of /MOTD command\r\n":
-        pass
+    helpers.drain_until(nc2, b":mantatail 376 nc :End of /MOTD command")
 
     nc2.sendall(b"QUIT\r\n")
-    while b"QUIT" not in helpers.receive_line(nc2):
-        pass
+    helpers.drain_until(nc2, b"QUIT")
     nc2.close()
 
     nc3 = socket.socket()
-    nc3.connect(("localhost", 6667))
+    nc3.connect(("localhost", run_server))
     nc3.sendall(b"NICK nc3\n")
 
+    # An unregistered user gets no reply to NICK, so there is no event to wait
+    # for before nc4 tries to take the same nick.
     time.sleep(0.1)
 
     nc4 = socket.socket()
-    nc4.connect(("localhost", 6667))
+    nc4.connect(("localhost", run_server))
     nc4.sendall(b"NICK nc3\n")
 
     assert helpers.receive_line(nc4) == b":mantatail 433 * nc3 :Nickname is already in use\r\n"
 
     nc3.sendall(b"QUIT\r\n")
-    while b"QUIT" not in helpers.receive_line(nc3):
-        pass
+    helpers.drain_until(nc3, b"QUIT")
     nc3.close()
 
     nc4.sendall(b"QUIT\r\n")
-    while b"QUIT" not in helpers.receive_line(nc4):
-        pass
+    helpers.drain_until(nc4, b"QUIT")
     nc4.close()
 
 
 def test_erroneus_nick(run_server, helpers):
     nc = socket.socket()
-    nc.connect(("localhost", 6667))
+    nc.connect(("localhost", run_server))
 
     nc.sendall(b"NICK 123newnick\n")
     assert helpers.receive_line(nc) == b":mantatail 432 123newnick :Erroneous Nickname\r\n"
@@ -1,11 +1,10 @@
 import pytest
 import socket
-import time
 
 
 def test_channel_topics(user_alice, user_bob, user_charlie, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
     while True:
@@ -15,8 +14,7 @@ def test_channel_topics(user_alice, user_bob, user_charlie, helpers):
         if received == b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
             break
 
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_alice.sendall(b"TOPIC\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 461 Alice TOPIC :Not enough parameters\r\n"
@@ -28,7 +26,6 @@ def test_channel_topics(user_alice, user_bob, user_charlie, helpers):
     assert helpers.receive_line(user_alice) == b":Alice!AliceUsr@127.0.0.1 TOPIC #foo :This is a topic\r\n"
     assert helpers.receive_line(user_bob) == b":Alice!AliceUsr@127.0.0.1 TOPIC #foo :This is a topic\r\n"
 
-    time.sleep(0.1)
     user_charlie.sendall(b"JOIN #foo\r\n")
     helpers.receive_line(user_charlie)
     assert helpers.receive_line(user_charlie) == b":mantatail 332 Charlie #foo :This is a topic\r\n"
@@ -63,19 +60,15 @@ def test_channel_topics(user_alice, user_bob, user_charlie, helpers):
 def test_chanmode_functionality(user_alice, user_bob, helpers):
     # +t allows only channel operators to set the topic.
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_bob.sendall(b"TOPIC #foo :This is a topic\r\n")
     assert helpers.receive_line(user_bob) == b":mantatail 482 Bob #foo :You're not channel operator\r\n"
 
-    time.sleep(0.1)
-
     user_alice.sendall(b"MODE #foo -t\r\n")
     assert helpers.receive_line(user_alice) == b":Alice!AliceUsr@127.0.0.1 MODE #foo -t\r\n"
     assert helpers.receive_line(user_bob) == b":Alice!AliceUsr@127.0.0.1 MODE #foo -t\r\n"
@@ -98,17 +91,14 @@ def test_chanmode_functionality(user_alice, user_bob, helpers):
 
 def test_mode_several_flags(user_alice, user_bob, user_charlie, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_bob, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
     user_charlie.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Charlie!CharlieUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":Charlie!CharlieUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_charlie) != b":mantatail 366 Charlie #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Charlie!CharlieUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":Charlie!CharlieUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_charlie, b":mantatail 366 Charlie #foo :End of /NAMES list.")
 
     user_alice.sendall(b"MODE #foo +ob Bob\r\n")
 
@@ -134,13 +124,11 @@ def test_mode_several_flags(user_alice, user_bob, user_charlie, helpers):
 
 def test_repeated_mode_messages(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_alice.sendall(b"MODE #foo +o Bob\r\n")
     assert helpers.receive_line(user_alice) == b":Alice!AliceUsr@127.0.0.1 MODE #foo +o Bob\r\n"
@@ -180,8 +168,7 @@ def test_repeated_mode_messages(user_alice, user_bob, helpers):
 def test_mode_errors(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":mantatail 366 Alice #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":mantatail 366 Alice #foo :End of /NAMES list.")
 
     user_alice.sendall(b"MODE #foo ^g Bob\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 472 Alice ^ :is an unknown mode char to me\r\n"
@@ -190,10 +177,9 @@ def test_mode_errors(user_alice, user_bob, helpers):
     assert helpers.receive_line(user_alice) == b":mantatail 472 Alice g :is an unknown mode char to me\r\n"
 
     user_bob.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_bob, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
     user_alice.sendall(b"MODE +o #foo Bob\r\n")
-    while helpers.receive_line(user_alice) != b":mantatail 403 Alice +o :No such channel\r\n":
-        pass
+    helpers.drain_until(user_alice, b":mantatail 403 Alice +o :No such channel")
 
     user_alice.sendall(b"MODE Bob #foo +o\r\n")
 
@@ -204,13 +190,11 @@ def test_mode_errors(user_alice, user_bob, helpers):
 
 def test_op_deop_user(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_alice.sendall(b"MODE #foo +o Bob\r\n")
     assert helpers.receive_line(user_alice) == b":Alice!AliceUsr@127.0.0.1 MODE #foo +o Bob\r\n"
@@ -223,11 +207,10 @@ def test_op_deop_user(user_alice, user_bob, helpers):
 
 def test_channel_owner(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":mantatail 366 Alice #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":mantatail 366 Alice #foo :End of /NAMES list.")
 
     while True:
         received = helpers.receive_line(user_bob)
@@ -237,9 +220,10 @@ def test_channel_owner(user_alice, user_bob, helpers):
 
     user_alice.sendall(b"PART #foo\r\n")
     user_bob.sendall(b"PART #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 PART #foo")
+    helpers.drain_until(user_bob, b":Bob!BobUsr@127.0.0.1 PART #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_bob, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
     user_alice.sendall(b"JOIN #foo\r\n")
 
     while True:
@@ -256,9 +240,9 @@ def test_operator_prefix(user_alice, user_bob, user_charlie, helpers):
     assert helpers.receive_line(user_alice) == b":mantatail 353 Alice = #foo :@Alice\r\n"
 
     user_bob.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
     user_alice.sendall(b"MODE #foo +o Bob\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 MODE #foo +o Bob")
     user_charlie.sendall(b"JOIN #foo\r\n")
 
     while True:
@@ -271,7 +255,7 @@ def test_operator_prefix(user_alice, user_bob, user_charlie, helpers):
 
     user_charlie.sendall(b"PART #foo\r\n")
     user_alice.sendall(b"MODE #foo -o Bob\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 MODE #foo -o Bob")
     user_charlie.sendall(b"JOIN #foo\r\n")
 
     while True:
@@ -284,7 +268,7 @@ def test_operator_prefix(user_alice, user_bob, user_charlie, helpers):
 
     user_charlie.sendall(b"PART #foo\r\n")
     user_alice.sendall(b"MODE #foo +o Bob\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 MODE #foo +o Bob")
     user_charlie.sendall(b"JOIN #foo\r\n")
 
     while True:
@@ -298,13 +282,11 @@ def test_operator_prefix(user_alice, user_bob, user_charlie, helpers):
 
 def operator_nickchange_then_kick(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_alice.sendall(b"NICK :NewNick\r\n")
     helpers.receive_line(user_bob)
@@ -323,13 +305,11 @@ def test_operator_no_such_channel(user_alice, helpers):
 
 def test_mode_no_operator_privileges(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_bob.sendall(b"MODE #foo +o Alice\r\n")
     assert helpers.receive_line(user_bob) == b":mantatail 482 Bob #foo :You're not channel operator\r\n"
@@ -344,8 +324,7 @@ def test_mode_no_operator_privileges(user_alice, user_bob, helpers):
 def test_operator_user_not_in_channel(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":mantatail 366 Alice #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":mantatail 366 Alice #foo :End of /NAMES list.")
 
     user_alice.sendall(b"MODE #foo +o Bob\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 441 Alice Bob #foo :They aren't on that channel\r\n"
@@ -353,13 +332,11 @@ def test_operator_user_not_in_channel(user_alice, user_bob, helpers):
 
 def test_kick_user(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_alice.sendall(b"KICK #foo Bob\r\n")
 
@@ -371,10 +348,8 @@ def test_kick_user(user_alice, user_bob, helpers):
 
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_alice.sendall(b"KICK #foo Bob Bye bye\r\n")
 
@@ -383,10 +358,8 @@ def test_kick_user(user_alice, user_bob, helpers):
 
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_alice.sendall(b"KICK #foo Bob :Reason with many words\r\n")
 
@@ -399,21 +372,18 @@ def test_kick_user(user_alice, user_bob, helpers):
 
     user_alice.sendall(b"PRIVMSG #foo :Foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":mantatail 403 Alice #foo :No such channel\r\n":
-        pass
+    helpers.drain_until(user_alice, b":mantatail 403 Alice #foo :No such channel")
 
 
 def test_kick_operator(user_alice, user_bob, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
 
     user_alice.sendall(b"MODE #foo +o Bob\r\n")
-    while helpers.receive_line(user_alice) != b":Alice!AliceUsr@127.0.0.1 MODE #foo +o Bob\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":Alice!AliceUsr@127.0.0.1 MODE #foo +o Bob\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 MODE #foo +o Bob")
+    helpers.drain_until(user_bob, b":Alice!AliceUsr@127.0.0.1 MODE #foo +o Bob")
 
     user_alice.sendall(b"KICK #foo Bob\r\n")
 
@@ -421,15 +391,12 @@ def test_kick_operator(user_alice, user_bob, helpers):
     assert helpers.receive_line(user_bob) == b":Alice!AliceUsr@127.0.0.1 KICK #foo Bob :Bob\r\n"
 
     user_bob.sendall(b"PRIVMSG #foo :Foo\r\n")
-    while helpers.receive_line(user_bob) != b":mantatail 442 Bob #foo :You're not on that channel\r\n":
-        pass
+    helpers.drain_until(user_bob, b":mantatail 442 Bob #foo :You're not on that channel")
 
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_bob.sendall(b"KICK #foo Alice\r\n")
     assert helpers.receive_line(user_bob) == b":mantatail 482 Bob #foo :You're not channel operator\r\n"
@@ -437,13 +404,11 @@ def test_kick_operator(user_alice, user_bob, helpers):
 
 def test_ban_functionality(user_alice, user_bob, user_charlie, helpers):
     user_alice.sendall(b"JOIN #foo\r\n")
-    time.sleep(0.1)
+    helpers.drain_until(user_alice, b":Alice!AliceUsr@127.0.0.1 JOIN #foo")
     user_bob.sendall(b"JOIN #foo\r\n")
 
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_alice.sendall(b"MODE #foo +b Bob\r\n")
     assert helpers.receive_line(user_alice) == b":Alice!AliceUsr@127.0.0.1 MODE #foo +b Bob!*@*\r\n"
@@ -458,7 +423,6 @@ def test_ban_functionality(user_alice, user_bob, user_charlie, helpers):
 
     user_bob.sendall(b"JOIN #foo\r\n")
     assert helpers.receive_line(user_bob) == b":mantatail 474 Bob #foo :Cannot join channel (+b) - you are banned\r\n"
-    time.sleep(0.1)
 
     user_alice.sendall(b"MODE #foo +b\r\n")
     assert helpers.receive_line(user_alice) == b":mantatail 367 Alice #foo Bob!*@* Alice!AliceUsr@127.0.0.1\r\n"
@@ -468,10 +432,8 @@ def test_ban_functionality(user_alice, user_bob, user_charlie, helpers):
     assert helpers.receive_line(user_alice) == b":Alice!AliceUsr@127.0.0.1 MODE #foo -b Bob!*@*\r\n"
 
     user_bob.sendall(b"JOIN #foo\r\n")
-    while helpers.receive_line(user_alice) != b":Bob!BobUsr@127.0.0.1 JOIN #foo\r\n":
-        pass
-    while helpers.receive_line(user_bob) != b":mantatail 366 Bob #foo :End of /NAMES list.\r\n":
-        pass
+    helpers.drain_until(user_alice, b":Bob!BobUsr@127.0.0.1 JOIN #foo")
+    helpers.drain_until(user_bob, b":mantatail 366 Bob #foo :End of /NAMES list.")
 
     user_bob.sendall(b"MODE #foo +b Alice\r\n")
     assert helpers.receive_line(user_bob) == b":mantatail 482 Bob #foo :You're not channel operator\r\n"
@@ -498,36 +460,35 @@ def test_ban_functionality(user_alice, user_bob, user_charlie, helpers):
 def test_channel_owner_kick_self(run_server, helpers):
     """Checks that a channel is properly removed when a channel's last user (operator) kicks themselves."""
     with socket.socket() as nc:
-        nc.connect(("localhost", 6667))
+        nc.connect(("localhost", run_server))
         nc.sendall(b"NICK nc\n")
         nc.sendall(b"USER nc 0 * :netcat\n")
         nc.sendall(b"JOIN #foo\n")
 
-        while helpers.receive_line(nc) != b":mantatail 366 nc #foo :End of /NAMES list.\r\n":
-            pass
+        helpers.drain_until(nc, b":mantatail 366 nc #foo :End of /NAMES list.")
 
         nc.sendall(b"KICK #foo nc\n")
         assert helpers.receive_line(nc) == b":nc!nc@127.0.0.1 KICK #foo nc :nc\r\n"
 
         nc.sendall(b"QUIT\n")
+        helpers.drain_until(nc, b":nc!nc@127.0.0.1 QUIT")
 
     with socket.socket() as nc:
-        nc.connect(("localhost", 6667))
+        nc.connect(("localhost", run_server))
         nc.sendall(b"NICK nc\n")
         nc.sendall(b"USER nc 0 * :netcat\n")
 
-        while helpers.receive_line(nc) != b":mantatail 376 nc :End of /MOTD command\r\n":
-            pass
+        helpers.drain_until(nc, b":mantatail 376 nc :End of /MOTD command")
 
         nc.sendall(b"PART #foo\n")
         assert helpers.receive_line(nc) == b":mantatail 403 nc #foo :No such channel\r\n"
 
         nc.sendall(b"JOIN #foo\n")
 
-        while helpers.receive_line(nc) != b":mantatail 366 nc #foo :End of /NAMES list.\r\n":
-            pass
+        helpers.drain_until(nc, b":mantatail 366 nc #foo :End of /NAMES list.")
 
         nc.sendall(b"KICK #foo nc\n")
         assert helpers.receive_line(nc) == b":nc!nc@127.0.0.1 KICK #foo nc :nc\r\n"
 
         nc.sendall(b"QUIT\n")
+        helpers.drain_until(nc, b":nc!nc@127.0.0.1 QUIT")